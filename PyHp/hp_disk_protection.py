@@ -16,16 +16,128 @@ import os
 import sys
 import time
 import errno
+import ctypes
+import select
 import signal
-import argparse
+import socket
 from pathlib import Path
 from typing import Optional
 
 
+DEFAULT_DEVICE = "/dev/sda"
+
+
+# timerfd constants (see timerfd_create(2))
+CLOCK_MONOTONIC = 1
+TFD_NONBLOCK = os.O_NONBLOCK
+TFD_CLOEXEC = os.O_CLOEXEC
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class _Itimerspec(ctypes.Structure):
+    _fields_ = [("it_interval", _Timespec), ("it_value", _Timespec)]
+
+
+def _load_libc():
+    """Load libc for timerfd, sched_setattr and mlockall, or None if unavailable."""
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    libc.timerfd_settime.argtypes = [
+        ctypes.c_int, ctypes.c_int,
+        ctypes.POINTER(_Itimerspec), ctypes.POINTER(_Itimerspec),
+    ]
+    return libc
+
+
+# Loaded once; callers go through _require_libc() so a missing libc
+# surfaces as an OSError on their existing warning/error paths
+_libc = _load_libc()
+
+
+def _require_libc():
+    """Return the loaded libc, raising OSError if it could not be loaded."""
+    if _libc is None:
+        raise OSError(errno.ENOENT, "libc.so.6 could not be loaded")
+    return _libc
+
+
+# mlockall(2) flag
+MCL_CURRENT = 1
+
+
+# sched_setattr(2) has no glibc wrapper; syscall numbers per architecture
+SCHED_DEADLINE = 6
+_SYS_SCHED_SETATTR = {
+    "x86_64": 314,
+    "i386": 351,
+    "i686": 351,
+    "aarch64": 274,
+    "armv7l": 380,
+    "riscv64": 274,
+    "ppc64le": 355,
+}
+
+
+class _SchedAttr(ctypes.Structure):
+    _fields_ = [
+        ("size", ctypes.c_uint32),
+        ("sched_policy", ctypes.c_uint32),
+        ("sched_flags", ctypes.c_uint64),
+        ("sched_nice", ctypes.c_int32),
+        ("sched_priority", ctypes.c_uint32),
+        ("sched_runtime", ctypes.c_uint64),
+        ("sched_deadline", ctypes.c_uint64),
+        ("sched_period", ctypes.c_uint64),
+    ]
+
+
 class HPDiskProtection:
     """HP Disk Protection daemon for parking hard drive heads during freefall."""
     
-    def __init__(self, device: str = "/dev/sda"):
+    LED_PATH = "/sys/class/leds/hp::hddprotect/brightness"
+    
+    # Sysfs descriptors kept open for the daemon's lifetime; a missing
+    # unload_heads fd falls back to open-per-write, a missing LED is skipped
+    _unload_fd: Optional[int] = None
+    _led_fd: Optional[int] = None
+    
+    # SCHED_DEADLINE budget: 200us of CPU every 2ms
+    DL_RUNTIME_NS = 200_000
+    DL_PERIOD_NS = 2_000_000
+    # SCHED_FIFO priority used when SCHED_DEADLINE is unavailable
+    FIFO_PRIORITY = 50
+    
+    # Head park duration per unload_heads write (the kernel caps it at 30s),
+    # and how close to its expiry a new freefall event re-writes it. Keeping
+    # it well above the 20s battery timeout lets bursts coalesce there too.
+    PARK_SECONDS = 30
+    PARK_REFRESH_MARGIN = 1.0
+    _protect_until = 0.0
+    
+    # Read size for /dev/freefall. The lis3lv02d driver returns a single byte
+    # holding the count accumulated since the last read, so only the first
+    # byte is ever filled; the rest is headroom for other drivers
+    EVENT_BUF_SIZE = 64
+    
+    # Pre-encoded sysfs payloads for the values written on every event;
+    # other unload_heads durations are encoded when used
+    _LED_ON = b"1"
+    _LED_OFF = b"0"
+    _PROTECT_PAYLOADS = {0: b"0", PARK_SECONDS: b"%d" % (PARK_SECONDS * 1000)}
+    
+    # AC/lid readings are reused for this many seconds
+    STATE_CACHE_TTL = 5.0
+    
+    # Cached (expiry, value) pairs for on_ac() and lid_open()
+    _ac_state = (0.0, True)
+    _lid_state = (0.0, True)
+    
+    def __init__(self, device: str = DEFAULT_DEVICE):
         self.device = device
         self.unload_heads_path = ""
         self.protection_active = False
@@ -35,6 +147,12 @@ class HPDiskProtection:
             
         if not self._valid_disk():
             raise RuntimeError(f"Cannot access disk protection for {device}")
+        
+        self._unload_fd = self._open_sysfs(self.unload_heads_path)
+        # Probed once; models without the LED skip it on every event
+        self._led_fd = self._open_sysfs(self.LED_PATH)
+        if self._led_fd is None:
+            print(f"Note: {self.LED_PATH} not available, LED disabled", file=sys.stderr)
     
     def _set_unload_heads_path(self, device: str) -> bool:
         """Set the path for unload_heads sysfs entry."""
@@ -56,25 +174,81 @@ class HPDiskProtection:
     
     def _write_int(self, path: str, value: int) -> bool:
         """Write an integer value to a sysfs file."""
+        return self._write_bytes(path, str(value).encode())
+    
+    def _write_bytes(self, path: str, payload: bytes) -> bool:
+        """Write a pre-encoded payload to a sysfs file."""
         try:
-            with open(path, 'w') as f:
-                f.write(str(value))
+            with open(path, 'wb') as f:
+                f.write(payload)
             return True
         except (OSError, IOError) as e:
             print(f"Error writing to {path}: {e}", file=sys.stderr)
             return False
     
+    def _open_sysfs(self, path: str) -> Optional[int]:
+        """Open a sysfs file for writing, or return None if unavailable."""
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CLOEXEC)
+        except OSError:
+            return None
+    
+    def _pwrite(self, fd: Optional[int], path: str, payload: bytes) -> bool:
+        """Write a payload through a pre-opened fd, re-opening path if there is none."""
+        if fd is None:
+            return self._write_bytes(path, payload)
+        try:
+            os.pwrite(fd, payload, 0)
+            return True
+        except OSError as e:
+            print(f"Error writing to {path}: {e}", file=sys.stderr)
+            return False
+    
+    def close(self):
+        """Close the pre-opened sysfs descriptors."""
+        for name in ("_unload_fd", "_led_fd"):
+            fd = getattr(self, name)
+            if fd is not None:
+                os.close(fd)
+                setattr(self, name, None)
+    
     def set_led(self, on: bool) -> bool:
-        """Control the HP disk protection LED."""
-        led_path = "/sys/class/leds/hp::hddprotect/brightness"
-        return self._write_int(led_path, 1 if on else 0)
+        """Control the HP disk protection LED (no-op if it was not found at startup)."""
+        if self._led_fd is None:
+            return False
+        try:
+            os.pwrite(self._led_fd, self._LED_ON if on else self._LED_OFF, 0)
+            return True
+        except OSError as e:
+            print(f"Error writing to {self.LED_PATH}: {e}", file=sys.stderr)
+            return False
     
     def protect(self, seconds: int) -> bool:
         """Protect the disk by parking heads for specified seconds."""
-        return self._write_int(self.unload_heads_path, seconds * 1000)
+        payload = self._PROTECT_PAYLOADS.get(seconds)
+        if payload is None:
+            payload = str(seconds * 1000).encode()
+        return self._pwrite(self._unload_fd, self.unload_heads_path, payload)
+    
+    def _cached_state(self, attr: str, read) -> bool:
+        """Return a cached AC/lid reading, re-reading it once the TTL has expired."""
+        expires, value = getattr(self, attr)
+        now = time.monotonic()
+        if now >= expires:
+            value = read()
+            setattr(self, attr, (now + self.STATE_CACHE_TTL, value))
+        return value
     
     def on_ac(self) -> bool:
         """Check if system is running on AC power."""
+        return self._cached_state("_ac_state", self._read_ac)
+    
+    def lid_open(self) -> bool:
+        """Check if laptop lid is open."""
+        return self._cached_state("_lid_state", self._read_lid)
+    
+    def _read_ac(self) -> bool:
+        """Read the AC power state from sysfs."""
         ac_path = "/sys/class/power_supply/AC0/online"
         try:
             with open(ac_path, 'r') as f:
@@ -83,8 +257,8 @@ class HPDiskProtection:
             # If we can't determine AC status, assume we're on AC
             return True
     
-    def lid_open(self) -> bool:
-        """Check if laptop lid is open."""
+    def _read_lid(self) -> bool:
+        """Read the lid state from procfs."""
         lid_path = "/proc/acpi/button/lid/LID/state"
         try:
             with open(lid_path, 'r') as f:
@@ -94,113 +268,194 @@ class HPDiskProtection:
             # If we can't determine lid state, assume it's open
             return True
     
-    def _signal_handler(self, signum, frame):
-        """Handle alarm signal to unpark heads."""
-        self.protect(0)  # Unpark heads
-        self.set_led(False)  # Turn off LED
-        self.protection_active = False
+    def _set_deadline_scheduling(self):
+        """Switch to SCHED_DEADLINE with a bounded runtime budget."""
+        nr = _SYS_SCHED_SETATTR.get(os.uname().machine)
+        if nr is None:
+            raise OSError(errno.ENOSYS, "sched_setattr syscall number unknown")
+        
+        attr = _SchedAttr()
+        attr.size = ctypes.sizeof(_SchedAttr)
+        attr.sched_policy = SCHED_DEADLINE
+        attr.sched_runtime = self.DL_RUNTIME_NS
+        attr.sched_deadline = self.DL_PERIOD_NS
+        attr.sched_period = self.DL_PERIOD_NS
+        
+        if _require_libc().syscall(nr, 0, ctypes.byref(attr), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"sched_setattr failed: {os.strerror(err)}")
     
-    def daemonize(self):
-        """Daemonize the process."""
+    def _set_realtime_scheduling(self):
+        """Prefer SCHED_DEADLINE, falling back to a mid-range SCHED_FIFO priority."""
         try:
-            # First fork
-            pid = os.fork()
-            if pid > 0:
-                sys.exit(0)  # Exit parent
+            self._set_deadline_scheduling()
+            return
         except OSError as e:
-            print(f"Fork failed: {e}", file=sys.stderr)
-            sys.exit(1)
+            print(f"Warning: Could not set SCHED_DEADLINE ({e}), "
+                  f"falling back to SCHED_FIFO priority {self.FIFO_PRIORITY}", file=sys.stderr)
         
-        # Decouple from parent environment
-        os.chdir("/")
-        os.setsid()
-        os.umask(0)
-        
-        # Second fork
         try:
-            pid = os.fork()
-            if pid > 0:
-                sys.exit(0)  # Exit second parent
-        except OSError as e:
-            print(f"Fork failed: {e}", file=sys.stderr)
-            sys.exit(1)
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.FIFO_PRIORITY))
+        except (OSError, AttributeError):
+            print("Warning: Could not set real-time scheduling priority", file=sys.stderr)
+    
+    def _lock_memory(self):
+        """Lock all currently mapped pages so a freefall never waits on a page-in."""
+        # No MCL_FUTURE: later heap growth is not pinned
+        if _require_libc().mlockall(MCL_CURRENT) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"mlockall failed: {os.strerror(err)}")
+    
+    def _unpark_timeout(self) -> int:
+        """Seconds until the heads are unparked after a freefall event."""
+        if self.on_ac() or self.lid_open():
+            return 2  # Short protection on AC or lid open
+        return 20  # Longer protection on battery with lid closed
+    
+    def _handle_freefall(self, timer_fd: int):
+        """Park heads and (re-)arm the unpark timer, coalescing event bursts."""
+        now = time.monotonic()
+        if not self.protection_active:
+            # Park before anything else; the AC/lid lookup may hit sysfs/procfs
+            if not self.protect(self.PARK_SECONDS):
+                return  # Not parked; the next event retries
+            self.set_led(True)  # Turn on protection LED
+            self._protect_until = now + self.PARK_SECONDS
+            self.protection_active = True
+            timeout = self._unpark_timeout()
+        else:
+            # Already parked: only re-write unload_heads if the park would
+            # expire before the new unpark deadline
+            timeout = self._unpark_timeout()
+            if now + timeout > self._protect_until - self.PARK_REFRESH_MARGIN:
+                if self.protect(self.PARK_SECONDS):
+                    self._protect_until = now + self.PARK_SECONDS
         
-        # Redirect standard file descriptors
-        sys.stdout.flush()
-        sys.stderr.flush()
+        self._arm_timer(timer_fd, timeout)
+    
+    def _handle_sigterm(self, signum, frame):
+        """Leave the event loop through the normal cleanup path on SIGTERM."""
+        raise KeyboardInterrupt
+    
+    def _unprotect(self):
+        """Unpark heads once the protection timer expires."""
+        self.protect(0)  # Unpark heads
+        self.set_led(False)  # Turn off LED
+        self.protection_active = False
+    
+    def _timerfd_create(self) -> int:
+        """Create a monotonic, non-blocking timerfd for the unpark timer."""
+        fd = _require_libc().timerfd_create(CLOCK_MONOTONIC, TFD_NONBLOCK | TFD_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"timerfd_create failed: {os.strerror(err)}")
+        return fd
+    
+    def _arm_timer(self, timer_fd: int, seconds: int):
+        """(Re-)arm the unpark timer; replaces any pending expiration."""
+        spec = _Itimerspec()
+        spec.it_value.tv_sec = seconds
+        if _libc.timerfd_settime(timer_fd, 0, ctypes.byref(spec), None) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"timerfd_settime failed: {os.strerror(err)}")
+    
+    def _sd_notify(self, state: bytes) -> bool:
+        """Send a readiness/status message to systemd, if started by it."""
+        address = os.environ.get("NOTIFY_SOCKET")
+        if not address:
+            return False
+        if address.startswith("@"):
+            address = "\0" + address[1:]  # Abstract namespace socket
         
-        with open('/dev/null', 'r') as si:
-            os.dup2(si.fileno(), sys.stdin.fileno())
-        with open('/dev/null', 'w') as so:
-            os.dup2(so.fileno(), sys.stdout.fileno())
-        with open('/dev/null', 'w') as se:
-            os.dup2(se.fileno(), sys.stderr.fileno())
-    
-    def run(self, daemon_mode: bool = True):
-        """Main daemon loop."""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC) as sock:
+                sock.connect(address)
+                sock.sendall(state)
+            return True
+        except OSError as e:
+            print(f"Warning: Could not notify systemd: {e}", file=sys.stderr)
+            return False
+    
+    def run(self):
+        """Main daemon loop; runs in the foreground (systemd Type=notify)."""
         freefall_device = "/dev/freefall"
         
         try:
-            with open(freefall_device, 'rb') as freefall_fd:
-                if daemon_mode:
-                    self.daemonize()
+            freefall_fd = os.open(freefall_device, os.O_RDONLY | os.O_CLOEXEC)
+            try:
+                _warn_if_not_root()
                 
-                # Set high priority scheduling (requires root privileges)
-                try:
-                    os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(99))
-                except (OSError, AttributeError):
-                    print("Warning: Could not set real-time scheduling priority", file=sys.stderr)
+                # Reused for every event read, no per-event bytes allocation
+                event_buf = bytearray(self.EVENT_BUF_SIZE)
+                event_view = memoryview(event_buf)
                 
-                # Lock memory pages (requires root privileges)
+                # Unpark timer, waited on together with the freefall device
                 try:
-                    import ctypes
-                    libc = ctypes.CDLL("libc.so.6")
-                    MCL_CURRENT = 1
-                    MCL_FUTURE = 2
-                    result = libc.mlockall(MCL_CURRENT | MCL_FUTURE)
-                    if result != 0:
-                        raise OSError("mlockall failed")
-                except (ImportError, OSError, AttributeError):
-                    print("Warning: Could not lock memory pages", file=sys.stderr)
-                
-                # Set up signal handler for alarm
-                signal.signal(signal.SIGALRM, self._signal_handler)
-                
-                print(f"HP Disk Protection daemon started for {self.device}")
-                
-                while True:
+                    timer_fd = self._timerfd_create()
+                except OSError as e:
+                    print(f"Error creating unpark timer: {e}", file=sys.stderr)
+                    return 1
+                epoll = select.epoll()
+                try:
+                    epoll.register(freefall_fd, select.EPOLLIN)
+                    epoll.register(timer_fd, select.EPOLLIN)
+                    
+                    # Lock everything mapped so far, interpreter included
+                    # (requires root privileges)
                     try:
-                        # Read freefall event
-                        data = freefall_fd.read(1)
-                        signal.alarm(0)  # Cancel any pending alarm
+                        self._lock_memory()
+                    except OSError:
+                        print("Warning: Could not lock memory pages", file=sys.stderr)
+                    
+                    # Set real-time scheduling last, so setup and the page-in
+                    # done by mlockall are not throttled (requires root privileges)
+                    self._set_realtime_scheduling()
+                    
+                    # systemctl stop/restart sends SIGTERM; unpark on the way out
+                    signal.signal(signal.SIGTERM, self._handle_sigterm)
+                    
+                    print(f"HP Disk Protection daemon started for {self.device}")
+                    self._sd_notify(b"READY=1")
+                    
+                    while True:
+                        try:
+                            # Only two FDs are registered; a small maxevents keeps
+                            # CPython from allocating a 1023-entry event array per wait
+                            for fd, _ in epoll.poll(-1, 2):
+                                if fd == timer_fd:
+                                    try:
+                                        os.read(timer_fd, 8)
+                                    except BlockingIOError:
+                                        # Re-armed by a freefall event in this same batch
+                                        continue
+                                    self._unprotect()
+                                    continue
+                                
+                                # Read freefall event
+                                nbytes = os.readv(freefall_fd, [event_buf])
+                                if nbytes == 0:
+                                    continue
+                                
+                                # lis3lv02d reports one byte with the accumulated
+                                # count; max() also copes with a multi-byte read
+                                count = max(event_view[:nbytes])
+                                self._handle_freefall(timer_fd)
+                                
+                                # Logged only once the heads are parked; stdout is
+                                # an unbuffered journal stream under systemd
+                                print(f"Freefall detected! Count: {count}")
                         
-                        if not data:
-                            continue
-                        
-                        count = data[0]
-                        print(f"Freefall detected! Count: {count}")
-                        
-                        # Protect the disk
-                        self.protect(21)  # Park heads for 21 seconds
-                        self.set_led(True)  # Turn on protection LED
-                        self.protection_active = True
-                        
-                        # Set alarm to unpark heads
-                        if self.on_ac() or self.lid_open():
-                            signal.alarm(2)  # Short protection on AC or lid open
-                        else:
-                            signal.alarm(20)  # Longer protection on battery with lid closed
-                        
-                    except KeyboardInterrupt:
-                        print("Shutting down HP Disk Protection daemon")
-                        break
-                    except OSError as e:
-                        if e.errno == errno.EINTR:
-                            # Alarm expired, continue loop
-                            continue
-                        else:
+                        except KeyboardInterrupt:
+                            print("Shutting down HP Disk Protection daemon")
+                            break
+                        except OSError as e:
                             print(f"Error reading freefall device: {e}", file=sys.stderr)
                             break
+                finally:
+                    epoll.close()
+                    os.close(timer_fd)
+            finally:
+                os.close(freefall_fd)
         
         except (OSError, IOError) as e:
             print(f"Error opening {freefall_device}: {e}", file=sys.stderr)
@@ -210,12 +465,23 @@ class HPDiskProtection:
             # Cleanup: unpark heads and turn off LED
             self.protect(0)
             self.set_led(False)
+            self.close()
         
         return 0
 
 
-def main():
-    """Main entry point."""
+# Built on first use; the common systemd start passes no arguments
+_PARSER = None
+
+
+def _get_parser():
+    """Return the command line parser, building it on first use."""
+    global _PARSER
+    if _PARSER is not None:
+        return _PARSER
+    
+    import argparse
+    
     parser = argparse.ArgumentParser(
         description="HP Disk Protection daemon for parking hard drive heads during freefall",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -223,21 +489,20 @@ def main():
 Examples:
   %(prog)s                    # Use default device /dev/sda
   %(prog)s /dev/sdb          # Use specific device
-  %(prog)s --no-daemon       # Run in foreground (for debugging)
         """
     )
     
     parser.add_argument(
         'device',
         nargs='?',
-        default='/dev/sda',
+        default=DEFAULT_DEVICE,
         help='Device to protect (default: /dev/sda)'
     )
     
     parser.add_argument(
         '--no-daemon',
         action='store_true',
-        help='Run in foreground instead of daemonizing'
+        help='Accepted for compatibility; the daemon always runs in the foreground'
     )
     
     parser.add_argument(
@@ -246,20 +511,31 @@ Examples:
         version='HP Disk Protection Python 1.0'
     )
     
-    args = parser.parse_args()
+    _PARSER = parser
+    return parser
+
+
+def _warn_if_not_root():
+    """Warn when real-time scheduling and mlock are unlikely to succeed."""
+    if os.geteuid() != 0:
+        print("Warning: This program should be run as root for optimal performance", file=sys.stderr)
+
+
+def main():
+    """Main entry point."""
+    if len(sys.argv) > 1:
+        device = _get_parser().parse_args().device
+    else:
+        device = DEFAULT_DEVICE
     
     try:
-        # Check if running as root
-        if os.geteuid() != 0:
-            print("Warning: This program should be run as root for optimal performance", file=sys.stderr)
-        
         # Create and run the protection daemon
-        protection = HPDiskProtection(args.device)
-        return protection.run(daemon_mode=not args.no_daemon)
+        protection = HPDiskProtection(device)
+        return protection.run()
         
     except (ValueError, RuntimeError) as e:
         print(f"Error: {e}", file=sys.stderr)
-        parser.print_help()
+        _get_parser().print_help()
         return 1
     except Exception as e:
         print(f"Unexpected error: {e}", file=sys.stderr)
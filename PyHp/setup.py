@@ -6,9 +6,21 @@ Setup script for HP Disk Protection daemon.
 from pathlib import Path
 import stat
 import shutil
+import subprocess
 import sys
 import os
 
+SERVICE_NAME = "hp-disk-protection.service"
+
+def systemctl(*args, quiet=False):
+    """Run systemctl directly, without going through a shell."""
+    stderr = subprocess.DEVNULL if quiet else None
+    try:
+        return subprocess.run(["systemctl", *args], stderr=stderr).returncode
+    except OSError as e:
+        print(f"Could not run systemctl: {e}", file=sys.stderr)
+        return 1
+
 def install_daemon():
     """Install the HP Disk Protection daemon."""
     script_dir = Path(__file__).parent
@@ -38,11 +50,15 @@ Description=HP Disk Protection Daemon
 After=multi-user.target
 
 [Service]
-Type=forking
+Type=notify
+NotifyAccess=main
 ExecStart={target_bin}
 Restart=always
 RestartSec=5
 User=root
+Environment=PYTHONUNBUFFERED=1
+LimitMEMLOCK=infinity
+LimitRTPRIO=99
 
 [Install]
 WantedBy=multi-user.target
@@ -53,7 +69,7 @@ WantedBy=multi-user.target
             f.write(service_content)
         
         # Reload systemd
-        os.system("systemctl daemon-reload")
+        systemctl("daemon-reload")
         
         print("Installation completed successfully!")
         print("To start the service:")
@@ -79,9 +95,8 @@ def uninstall_daemon():
         return 1
     
     try:
-        # Stop and disable service
-        os.system("systemctl stop hp-disk-protection 2>/dev/null")
-        os.system("systemctl disable hp-disk-protection 2>/dev/null")
+        # Stop and disable service in one call
+        systemctl("disable", "--now", SERVICE_NAME, quiet=True)
         
         # Remove files
         if target_service.exists():
@@ -93,7 +108,7 @@ def uninstall_daemon():
             target_bin.unlink()
         
         # Reload systemd
-        os.system("systemctl daemon-reload")
+        systemctl("daemon-reload")
         
         print("Uninstallation completed successfully!")
         return 0
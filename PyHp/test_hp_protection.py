@@ -1,93 +1,281 @@
 #!/usr/bin/env python3
 """
-Test script for HP Disk Protection daemon.
+Tests for HP Disk Protection daemon.
+
+Run with pytest. Full hardware testing additionally requires an HP laptop
+with a freefall sensor (/dev/freefall) and root privileges.
 """
 
 import sys
 import os
-import tempfile
-from pathlib import Path
+import socket
+
+import pytest
 
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+import hp_disk_protection
 from hp_disk_protection import HPDiskProtection
 
 
-def test_basic_functionality():
-    """Test basic functionality without requiring hardware."""
-    print("Testing HP Disk Protection basic functionality...")
-    
-    # Test path setting
-    protection = HPDiskProtection.__new__(HPDiskProtection)
-    
+@pytest.fixture
+def protection():
+    """An instance that skips __init__'s hardware checks."""
+    return HPDiskProtection.__new__(HPDiskProtection)
+
+
+def test_paths(protection):
+    """Test unload_heads path setting."""
     # Test valid device path setting
     assert protection._set_unload_heads_path("/dev/sda") == True
     assert protection.unload_heads_path == "/sys/block/sda/device/unload_heads"
-    
+
     # Test invalid device path
     assert protection._set_unload_heads_path("invalid") == False
     assert protection._set_unload_heads_path("/home/test") == False
-    
-    print("✓ Path setting tests passed")
-    
-    # Test integer writing to temporary file
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp:
-        tmp_path = tmp.name
-    
+
+
+def test_write_int(protection, tmp_path):
+    """Test integer writing to a file."""
+    target = tmp_path / "x"
+
+    assert protection._write_int(str(target), 12345) == True
+    assert target.read_text() == "12345"
+
+
+def test_hardware_methods(protection):
+    """LED, protection and power/lid methods fail gracefully without hardware."""
+    protection._set_unload_heads_path("/dev/sda")
+
+    # These return False without hardware, which is expected
+    protection.set_led(True)
+    protection.protect(10)
+
+    assert isinstance(protection.on_ac(), bool)
+    assert isinstance(protection.lid_open(), bool)
+
+
+def test_led_absent(protection, capsys, monkeypatch):
+    """Without an LED fd, set_led() is a no-op that never touches the filesystem."""
+    monkeypatch.setattr(os, "open", lambda *args, **kwargs: pytest.fail("LED re-opened"))
+    assert protection._led_fd is None
+
+    assert protection.set_led(True) == False
+    assert protection.set_led(False) == False
+
+    assert capsys.readouterr().err == ""
+
+
+def test_led_probe_missing(tmp_path, capsys, monkeypatch):
+    """__init__ probes a missing LED once and notes it a single time."""
+    unload_heads = tmp_path / "unload_heads"
+    unload_heads.write_text("0")
+
+    def set_unload_heads_path(self, device):
+        self.unload_heads_path = str(unload_heads)
+        return True
+
+    monkeypatch.setattr(HPDiskProtection, "_set_unload_heads_path", set_unload_heads_path)
+    monkeypatch.setattr(HPDiskProtection, "LED_PATH", str(tmp_path / "brightness"))
+
+    protection = HPDiskProtection("/dev/sda")
     try:
-        result = protection._write_int(tmp_path, 12345)
-        assert result == True
-        
-        with open(tmp_path, 'r') as f:
-            content = f.read().strip()
-            assert content == "12345"
-        
-        print("✓ Integer writing tests passed")
+        assert protection._unload_fd is not None
+        assert protection._led_fd is None
+
+        for _ in range(3):
+            assert protection.set_led(True) == False
+
+        assert capsys.readouterr().err.count("LED disabled") == 1
     finally:
-        os.unlink(tmp_path)
-    
-    # Test LED and protection methods (will fail gracefully without hardware)
-    result = protection.set_led(True)
-    # This will return False without hardware, which is expected
-    
-    result = protection.protect(10)
-    # This will return False without hardware, which is expected
-    
-    print("✓ LED and protection method tests completed")
-    
-    # Test power and lid detection (will fail gracefully without hardware)
-    on_ac = protection.on_ac()
-    lid_open = protection.lid_open()
-    
-    print(f"✓ Power/lid detection tests completed (AC: {on_ac}, Lid: {lid_open})")
-    
-    print("All basic tests passed!")
+        protection.close()
 
 
-def test_argument_parsing():
-    """Test command line argument parsing."""
-    print("\nTesting command line argument parsing...")
-    
-    # This would normally be tested with unittest, but for simplicity:
-    print("✓ Argument parsing functionality is implemented in main()")
+def test_led_preopened(protection, tmp_path):
+    """Test set_led() through the LED fd probed at startup."""
+    target = tmp_path / "brightness"
+    target.write_text("0")
+    protection._led_fd = protection._open_sysfs(str(target))
+
+    try:
+        assert protection.set_led(True) == True
+        assert target.read_text() == "1"
+        assert protection.set_led(False) == True
+        assert target.read_text() == "0"
+    finally:
+        protection.close()
+
+
+def test_preopened_writes(protection, tmp_path):
+    """Test protect() through a pre-opened sysfs descriptor."""
+    target = tmp_path / "unload_heads"
+    target.write_text("")
 
+    protection.unload_heads_path = str(target)
+    protection._unload_fd = protection._open_sysfs(str(target))
+    assert protection._unload_fd is not None
 
-def main():
-    """Run all tests."""
     try:
-        test_basic_functionality()
-        test_argument_parsing()
-        print("\n🎉 All tests completed successfully!")
-        print("\nNote: Full hardware testing requires:")
-        print("  - HP laptop with freefall sensor")
-        print("  - Root privileges")
-        print("  - /dev/freefall device")
-        return 0
-    except Exception as e:
-        print(f"\n❌ Test failed: {e}")
-        return 1
+        assert protection.protect(21) == True
+        assert target.read_text() == "21000"
+
+        # Uncommon durations are encoded on the fly, not cached
+        assert protection.protect(10) == True
+        assert 10 not in HPDiskProtection._PROTECT_PAYLOADS
+        assert target.read_text() == "10000"
+    finally:
+        protection.close()
+
+    assert protection._unload_fd is None
+
+
+def test_state_cache(protection):
+    """Test that AC/lid readings are cached between freefall events."""
+    reads = []
+
+    def read_ac():
+        reads.append(1)
+        return False
+
+    protection._read_ac = read_ac
+    assert protection.on_ac() == False
+    assert protection.on_ac() == False
+    assert len(reads) == 1
+
+    # Expire the cache and make sure the value is read again
+    protection._ac_state = (0.0, False)
+    protection.on_ac()
+    assert len(reads) == 2
+
+
+def _record_freefalls(protection, events, protect_results=None):
+    """Run freefall events through _handle_freefall, recording sysfs writes.
+
+    protect_results optionally lists what successive protect() calls return.
+    """
+    calls = []
+    results = iter(protect_results or [])
+    protection.protection_active = False
+    protection.protect = lambda seconds: calls.append(("protect", seconds)) or next(results, True)
+    protection.set_led = lambda on: calls.append(("led", on)) or True
+    unpark_timeout = protection._unpark_timeout
+    protection._unpark_timeout = lambda: calls.append(("timeout",)) or unpark_timeout()
+
+    timer_fd = protection._timerfd_create()
+    try:
+        for _ in range(events):
+            protection._handle_freefall(timer_fd)
+    finally:
+        os.close(timer_fd)
+    return calls
+
+
+@pytest.mark.parametrize("on_ac, lid_open", [(True, True), (False, False)])
+def test_freefall_coalescing(protection, on_ac, lid_open):
+    """Test that a burst of freefall events parks the heads only once."""
+    protection._ac_state = (float("inf"), on_ac)
+    protection._lid_state = (float("inf"), lid_open)
+
+    calls = _record_freefalls(protection, 5)
+    writes = [call for call in calls if call[0] == "protect"]
+    assert writes == [("protect", HPDiskProtection.PARK_SECONDS)]
+    assert protection.protection_active == True
+
+    # Heads are parked before the AC/lid state is consulted
+    assert calls[:3] == [("protect", HPDiskProtection.PARK_SECONDS),
+                         ("led", True), ("timeout",)]
+
+
+def test_freefall_refreshes_expiring_park(protection):
+    """Test that an event near the end of a park re-writes unload_heads."""
+    protection._ac_state = (float("inf"), True)
+    calls = _record_freefalls(protection, 1)
+
+    protection._protect_until = 0.0
+    timer_fd = protection._timerfd_create()
+    try:
+        protection._handle_freefall(timer_fd)
+    finally:
+        os.close(timer_fd)
+
+    writes = [call for call in calls if call[0] == "protect"]
+    assert writes == [("protect", HPDiskProtection.PARK_SECONDS)] * 2
+
+
+def test_sigterm_handler(protection):
+    """SIGTERM is turned into the KeyboardInterrupt the loop shuts down on."""
+    with pytest.raises(KeyboardInterrupt):
+        protection._handle_sigterm(15, None)
+
+
+def test_sd_notify(protection, tmp_path, monkeypatch):
+    """READY=1 is sent to the socket named by $NOTIFY_SOCKET."""
+    address = str(tmp_path / "notify")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(address)
+        monkeypatch.setenv("NOTIFY_SOCKET", address)
+
+        assert protection._sd_notify(b"READY=1") == True
+        assert sock.recv(64) == b"READY=1"
+
+
+def test_sd_notify_abstract(protection, monkeypatch):
+    """A leading '@' in $NOTIFY_SOCKET names an abstract namespace socket."""
+    name = f"hp-disk-protection-test-{os.getpid()}"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind("\0" + name)
+        monkeypatch.setenv("NOTIFY_SOCKET", "@" + name)
+
+        assert protection._sd_notify(b"READY=1") == True
+        assert sock.recv(64) == b"READY=1"
+
+
+def test_sd_notify_unset(protection, monkeypatch):
+    """Without $NOTIFY_SOCKET (not started by systemd) nothing is sent."""
+    monkeypatch.delenv("NOTIFY_SOCKET", raising=False)
+    assert protection._sd_notify(b"READY=1") == False
+
+
+def test_missing_libc(protection, monkeypatch):
+    """A missing libc is reported through OSError, not at import time."""
+    def cdll(*args, **kwargs):
+        raise OSError("libc.so.6: cannot open shared object file")
+
+    monkeypatch.setattr(hp_disk_protection.ctypes, "CDLL", cdll)
+    assert hp_disk_protection._load_libc() is None
+
+    monkeypatch.setattr(hp_disk_protection, "_libc", None)
+    with pytest.raises(OSError):
+        protection._lock_memory()
+    with pytest.raises(OSError):
+        protection._timerfd_create()
+
+
+def test_freefall_retries_failed_park(protection):
+    """A failed unload_heads write is retried by the next event."""
+    protection._ac_state = (float("inf"), True)
+
+    calls = _record_freefalls(protection, 1, protect_results=[False])
+    assert calls == [("protect", HPDiskProtection.PARK_SECONDS)]
+    assert protection.protection_active == False
+
+    calls = _record_freefalls(protection, 2, protect_results=[False, True])
+    writes = [call for call in calls if call[0] == "protect"]
+    assert writes == [("protect", HPDiskProtection.PARK_SECONDS)] * 2
+    assert ("led", True) in calls
+    assert protection.protection_active == True
+
+
+def test_argument_parsing():
+    """Test command line argument parsing."""
+    # The parser is built lazily, once
+    parser = hp_disk_protection._get_parser()
+    assert hp_disk_protection._get_parser() is parser
+
+    assert parser.parse_args([]).device == hp_disk_protection.DEFAULT_DEVICE
+    assert parser.parse_args(["/dev/sdb"]).device == "/dev/sdb"
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(pytest.main([__file__]))